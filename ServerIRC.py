@@ -1,7 +1,8 @@
 from protocol import *
+from StorageIRC import StorageIRC, MemoryStorageIRC
 import threading
 import socket
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 
 
 class ServerIRC:
@@ -13,32 +14,34 @@ class ServerIRC:
         1. De client à client pour les conversations privées.
         2. Par diffusion à tous les clients d'un canal.
 
-    Le serveur utilise en interne des collections qui sont supposées thread-safe en CPython.
-    Cependant pour éviter des collisions de clé des verrous sont nécessaires :
-        1. Pour l'enregistrement d'un nouvel utilisateur
-        2. Pour la création d'un nouveau canal
+    L'état des utilisateurs et des canaux est délégué à un stockage (voir StorageIRC)
+    qui garantit l'absence de collision de clé. Par défaut il s'agit de
+    dictionnaires en mémoire, mais il peut être partagé avec d'autres processus.
+    Seuls les sockets des clients connectés à ce processus restent locaux.
 
     Chaque client garde sa connexion ouverte avec le serveur.
     Le serveur peut envoyer plusieurs messages simultanément à un même client.
     Or, les sockets ne sont pas thread-safe et devront donc être verrouillés.
     """
-    def __init__(self, help_msg: bytes, default_channel: str):
+    def __init__(self, help_msg: bytes, default_channel: str,
+                 storage: Optional[StorageIRC] = None):
         """
         :param help: Message d'aide à envoyer au client
         :param default_channel: Nom du canal par défaut lorsqu'un client se connecte
+        :param storage: Stockage de l'état partagé (MemoryStorageIRC par défaut)
         """
         self.help_msg = help_msg
         self.default_channel = default_channel
 
-        # Dictionnaire des informations utilisateurs
+        # Stockage des utilisateurs et des canaux
+        # Simplification: Les canaux ne peuvent pas être supprimés
+        self.storage = storage if storage is not None else MemoryStorageIRC()
+        self.storage.add_channel(default_channel, None)
+
+        # Dictionnaire des sockets des clients connectés à ce serveur
         # Contrainte: Les utilisateurs peuvent être supprimés
         self.lock_users = threading.Lock()
-        self.users = dict()
-
-        # Dictionnaire des canaux avec ensemble des utilisateurs connectés
-        # Simplification: Les canaux ne peuvent pas être supprimés
-        self.lock_channels = threading.Lock()
-        self.channels = {default_channel: {"key": None, "users": set()}}
+        self.sockets = dict()
 
 
     def __socket(self, nick: str) -> Tuple[socket.socket, threading.Lock]:
@@ -48,7 +51,19 @@ class ServerIRC:
         :param nick: Pseudo de l'utilisateur
         :return: (socket, verrou) du client
         """
-        return (self.users[nick]["socket"], self.users[nick]["lock_socket"])
+        return self.sockets[nick]
+
+
+    def __is_local(self, nick: str) -> bool:
+        """
+        Permet de savoir si un utilisateur est connecté à ce serveur.
+        Lorsque le stockage est partagé, un utilisateur existant peut être
+        connecté à un autre serveur et ne peut pas recevoir de message d'ici.
+
+        :param nick: Pseudo de l'utilisateur
+        :return: True si le socket du client est détenu par ce serveur
+        """
+        with self.lock_users: return nick in self.sockets
 
 
     def __send(self, msg: bytes, nick: str, check_nick=False):
@@ -75,15 +90,15 @@ class ServerIRC:
         # pendant que l'on récupère son socket
         if check_nick: self.lock_users.acquire()
         # Si le client n'existe pas on ne fait rien
-        if not check_nick or nick in self.users:
+        if not check_nick or nick in self.sockets:
             sc, lock_sc = self.__socket(nick)
             if check_nick: self.lock_users.release()
             # On verrouille l'accès au socket du client
             with lock_sc:
                 try: sc.send(msg)
-                # Si le socket est brisé le message n'est pas envoyé
+                # Si le socket est brisé ou fermé le message n'est pas envoyé
                 # L'erreur n'est pas remontée pour éviter d'interrompre le thread
-                except BrokenPipeError: pass
+                except OSError: pass
             return
         self.lock_users.release()
 
@@ -108,28 +123,33 @@ class ServerIRC:
 
         :return: True si le client a bien été ajouté False sinon
         """
-        # Enregistrement de l'utilisateur s'il n'existe pas déjà
-        # Deux clients choisissant le même nickname ne doivent pas passer
-        # en même temps cette section critique
-        self.lock_users.acquire()
-        if nick in self.users:
-            self.lock_users.release()
-            socket_client.send(NICKNAME_ERROR)
-            socket_client.close()
-            return False
-
-        self.users[nick] = {
-            "channel": self.default_channel,
-            "away_msg": "",
-            "socket": socket_client,
-            "lock_socket": threading.Lock()}
-        self.lock_users.release()
-
-        # Envoi au client du nom du canal par défaut
-        socket_client.send(self.default_channel.encode('utf-8'))
+        # Le socket est verrouillé pendant tout l'enregistrement :
+        # un message envoyé entre temps attend que le nom du canal par défaut
+        # soit envoyé, ou n'est pas envoyé si le pseudo est refusé
+        lock_sc = threading.Lock()
+        with lock_sc:
+            # Réservation du pseudo parmi les clients de ce serveur
+            # Seul l'accès au dictionnaire local des sockets est verrouillé
+            # pour ne pas bloquer l'envoi de messages pendant une écriture du stockage
+            with self.lock_users:
+                taken = nick in self.sockets
+                if not taken: self.sockets[nick] = (socket_client, lock_sc)
+
+            # Enregistrement de l'utilisateur s'il n'existe pas déjà
+            # Le stockage garantit que deux clients choisissant le même nickname
+            # ne peuvent pas être enregistrés tous les deux
+            if taken or not self.storage.add_user(nick, self.default_channel):
+                if not taken:
+                    with self.lock_users: self.sockets.pop(nick)
+                socket_client.send(NICKNAME_ERROR)
+                socket_client.close()
+                return False
+
+            # Envoi au client du nom du canal par défaut
+            socket_client.send(self.default_channel.encode('utf-8'))
 
         # Ajout de l'utilisateur au canal par défaut
-        self.channels[self.default_channel]["users"].add(nick)
+        self.storage.join_channel(self.default_channel, nick)
         return True
 
 
@@ -141,15 +161,22 @@ class ServerIRC:
         """
         sc, lock_sc = self.__socket(nick)
 
-        # On retire l'utilisateur du canal sur lequel il est connecté
-        self.channels[self.users[nick]["channel"]]["users"].remove(nick)
+        try:
+            # On retire l'utilisateur du canal sur lequel il est connecté
+            self.storage.leave_channel(self.storage.get_channel(nick), nick)
 
-        # On supprime l'utilisateur
-        # Il faut verrouiller pour ne pas faire échouer l'envoi de message
-        with self.lock_users: self.users.pop(nick)
+            # On supprime l'utilisateur du stockage en dehors du verrou
+            # car l'écriture peut attendre que la base soit déverrouillée
+            self.storage.remove_user(nick)
 
-        # On ferme la connexion et on arrête le thread
-        with lock_sc: sc.close()
+        # Même si le stockage échoue la connexion doit être fermée
+        finally:
+            # On supprime le socket de l'utilisateur
+            # Il faut verrouiller pour ne pas faire échouer l'envoi de message
+            with self.lock_users: self.sockets.pop(nick)
+
+            # On ferme la connexion et on arrête le thread
+            with lock_sc: sc.close()
 
 
     def unknown_cmd(self, nick: str):
@@ -185,15 +212,15 @@ class ServerIRC:
             return
 
         # L'utilisateur prévient qu'il n'est plus absent
-        if len(cmd) == 1 and self.users[nick]["away_msg"] != "":
-            self.users[nick]["away_msg"] = ""
+        if len(cmd) == 1 and self.storage.get_away(nick) != "":
+            self.storage.set_away(nick, "")
         # L'utilisateur prévient qu'il est absent
         else:
             # Message par défaut
             away_msg = "Je suis absent pour le moment."
             # Message personnalisé
             if len(cmd) == 2: away_msg = cmd[1]
-            self.users[nick]["away_msg"] = away_msg
+            self.storage.set_away(nick, away_msg)
 
 
     def help(self, nick: str):
@@ -219,14 +246,19 @@ class ServerIRC:
 
         dest_nick = cmd[1] # Pseudo du destinataire
         # Le destinataire n'existe pas
-        if dest_nick not in self.users:
+        if not self.storage.has_user(dest_nick):
             self.__send(NICKNAME_ERROR, nick)
             return
 
+        # Le destinataire est connecté à un autre serveur
+        if not self.__is_local(dest_nick):
+            self.__send(REMOTE_USER_ERROR, nick)
+            return
+
         # Canal courant de l'utilisateur invitant
-        chan = self.users[nick]["channel"]
+        chan = self.storage.get_channel(nick)
 
-        key = self.channels[chan]["key"]
+        key = self.storage.get_key(chan)
         invite = f"<{nick}> Bonjour <{dest_nick}> je t'invite à me rejoindre sur le canal {chan}."
         # Le canal est-il protégé par une clé de sécurité ?
         if key is not None:
@@ -256,24 +288,23 @@ class ServerIRC:
             key = cmd[2]
 
         # Création éventuelle du canal
-        with self.lock_channels:
-            if chan not in self.channels:
-                self.channels[chan] = {"key": key, "users": set()}
+        self.storage.add_channel(chan, key)
 
         # La clé de sécurité est incorrecte
-        if self.channels[chan]["key"] != key:
+        if self.storage.get_key(chan) != key:
             self.__send(CHANNEL_KEY_ERROR, nick)
             return
 
         # Ajout de l'utilisateur au canal
-        self.channels[chan]["users"].add(nick)
+        self.storage.join_channel(chan, nick)
 
         # Déconnexion de l'utilisateur du canal précédent
-        if self.users[nick]["channel"] != chan:
-            self.channels[self.users[nick]["channel"]]["users"].remove(nick)
+        prev_chan = self.storage.get_channel(nick)
+        if prev_chan != chan:
+            self.storage.leave_channel(prev_chan, nick)
 
         # Connexion de l'utilisateur au canal choisi
-        self.users[nick]["channel"] = chan
+        self.storage.set_channel(nick, chan)
 
         # Envoi du canal au client
         self.__send(("/join "+chan).encode('utf-8'), nick)
@@ -285,7 +316,7 @@ class ServerIRC:
 
         :param nick: Pseudo de l'utilisateur
         """
-        list_channels = '\n'.join(list(self.channels.keys())).encode('utf-8')
+        list_channels = '\n'.join(self.storage.list_channels()).encode('utf-8')
         self.__send(list_channels, nick)
 
 
@@ -309,38 +340,41 @@ class ServerIRC:
         if len(cmd) == 2 or cmd[1].startswith('#'):
             chan = (
                 # Canal courant de l'expéditeur
-                self.users[nick]["channel"] if len(cmd) == 2
+                self.storage.get_channel(nick) if len(cmd) == 2
                 # Canal renseigné dans la commande
                 else cmd[1])
 
             if len(cmd) == 3 and cmd[1].startswith('#'):
                 # Est-ce que le canal existe ?
-                if chan not in self.channels:
+                if not self.storage.has_channel(chan):
                     self.__send(CHANNEL_ERROR, nick)
                     return
 
                 # On ne peut pas envoyer un message sur un canal privé
-                if self.channels[chan]["key"] is not None:
+                if self.storage.get_key(chan) is not None:
                     self.__send(CHANNEL_KEY_ERROR, nick)
                     return
 
             msg = f"{chan} <{nick}> "+msg
             # Envoi du message à tous les utilisateurs connectés au canal
-            dest_users = self.channels[chan]["users"]
+            dest_users = self.storage.channel_users(chan)
 
         # Destinataire renseigné sans canal
         else:
             dest_nick = cmd[1]
 
-            self.lock_users.acquire()
             # Est-ce que le destinataire existe ?
-            if dest_nick not in self.users:
-                self.lock_users.release()
+            # La lecture du message d'absence vaut test d'existence
+            # en une seule opération sur le stockage
+            away_msg = self.storage.get_away(dest_nick)
+            if away_msg is None:
                 self.__send(NICKNAME_ERROR, nick)
                 return
 
-            away_msg = self.users[dest_nick]["away_msg"]
-            self.lock_users.release()
+            # Le destinataire est connecté à un autre serveur
+            if not self.__is_local(dest_nick):
+                self.__send(REMOTE_USER_ERROR, nick)
+                return
 
             # Le destinataire est absent
             if away_msg != "":
@@ -374,13 +408,13 @@ class ServerIRC:
         elif len(cmd) == 2:
             chan = '#'+cmd[1].replace('#', '')
             # Est-ce que le canal existe ?
-            if chan not in self.channels:
+            if not self.storage.has_channel(chan):
                 self.__send(CHANNEL_ERROR, nick)
                 return
-            list_names = '\n'.join(self.channels[chan]["users"])
+            list_names = '\n'.join(self.storage.channel_users(chan))
 
         # Pas de canal spécifié
         else:
-            list_names = '\n'.join(self.users.keys())
+            list_names = '\n'.join(self.storage.list_users())
 
         self.__send(list_names.encode('utf-8'), nick)
@@ -0,0 +1,595 @@
+import sys
+import threading
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from typing import List, Optional, Tuple
+
+
+class StorageIRC(ABC):
+    """
+    Interface de stockage de l'état partagé du serveur IRC.
+
+    L'état enregistré est celui qui peut être lu en dehors du processus serveur
+    (outil d'administration, serveur de secours) :
+        1. Les utilisateurs avec leur canal courant et leur message d'absence.
+        2. Les canaux avec leur clé de sécurité et leurs utilisateurs connectés.
+
+    Les sockets et leurs verrous ne font pas partie de l'état partagé
+    car ils n'ont de sens que dans le processus qui les a ouverts.
+
+    Une implémentation qui ne définit pas toutes les méthodes abstraites
+    ne peut pas être instanciée.
+
+    Chaque implémentation doit être thread-safe et garantir l'atomicité
+    de add_user et add_channel (pas de collision de clé).
+    """
+    @abstractmethod
+    def add_user(self, nick: str, channel: str) -> bool:
+        """
+        Enregistre un nouvel utilisateur s'il n'existe pas déjà.
+
+        :param nick: Pseudo de l'utilisateur
+        :param channel: Canal courant de l'utilisateur
+        :return: True si l'utilisateur a bien été ajouté False sinon
+        (pseudo déjà utilisé ou stockage indisponible)
+        """
+        pass
+
+    @abstractmethod
+    def remove_user(self, nick: str):
+        """
+        Supprime un utilisateur.
+
+        :param nick: Pseudo de l'utilisateur
+        """
+        pass
+
+    @abstractmethod
+    def has_user(self, nick: str) -> bool:
+        """
+        :param nick: Pseudo de l'utilisateur
+        :return: True si l'utilisateur existe False sinon
+        """
+        pass
+
+    @abstractmethod
+    def list_users(self) -> List[str]:
+        """
+        :return: Pseudos de tous les utilisateurs
+        """
+        pass
+
+    @abstractmethod
+    def get_channel(self, nick: str) -> str:
+        """
+        :param nick: Pseudo de l'utilisateur
+        :return: Canal courant de l'utilisateur
+        """
+        pass
+
+    @abstractmethod
+    def set_channel(self, nick: str, channel: str):
+        """
+        :param nick: Pseudo de l'utilisateur
+        :param channel: Nouveau canal courant de l'utilisateur
+        """
+        pass
+
+    @abstractmethod
+    def get_away(self, nick: str) -> Optional[str]:
+        """
+        :param nick: Pseudo de l'utilisateur
+        :return: Message d'absence ("" si présent) ou None si l'utilisateur n'existe pas
+        """
+        pass
+
+    @abstractmethod
+    def set_away(self, nick: str, away_msg: str):
+        """
+        :param nick: Pseudo de l'utilisateur
+        :param away_msg: Message d'absence ("" pour signaler son retour)
+        """
+        pass
+
+    @abstractmethod
+    def add_channel(self, channel: str, key: Optional[str]):
+        """
+        Crée un canal s'il n'existe pas déjà.
+        Si le canal existe, sa clé n'est pas modifiée.
+
+        :param channel: Nom du canal
+        :param key: Clé de sécurité du canal (None si le canal est public)
+        """
+        pass
+
+    @abstractmethod
+    def has_channel(self, channel: str) -> bool:
+        """
+        :param channel: Nom du canal
+        :return: True si le canal existe False sinon
+        """
+        pass
+
+    @abstractmethod
+    def list_channels(self) -> List[str]:
+        """
+        :return: Noms de tous les canaux
+        """
+        pass
+
+    @abstractmethod
+    def get_key(self, channel: str) -> Optional[str]:
+        """
+        :param channel: Nom du canal
+        :return: Clé de sécurité du canal (None si le canal est public)
+        """
+        pass
+
+    @abstractmethod
+    def channel_users(self, channel: str) -> List[str]:
+        """
+        :param channel: Nom du canal
+        :return: Pseudos des utilisateurs connectés au canal
+        """
+        pass
+
+    @abstractmethod
+    def join_channel(self, channel: str, nick: str):
+        """
+        :param channel: Nom du canal
+        :param nick: Pseudo de l'utilisateur à ajouter au canal
+        """
+        pass
+
+    @abstractmethod
+    def leave_channel(self, channel: str, nick: str):
+        """
+        :param channel: Nom du canal
+        :param nick: Pseudo de l'utilisateur à retirer du canal
+        """
+        pass
+
+    def close(self):
+        """
+        Libère les ressources du stockage.
+        """
+        pass
+
+
+class MemoryStorageIRC(StorageIRC):
+    """
+    Stockage par défaut dans des dictionnaires du processus courant.
+
+    Les collections sont supposées thread-safe en CPython.
+    Les verrous ne sont nécessaires que pour éviter les collisions de clé :
+        1. Pour l'enregistrement d'un nouvel utilisateur
+        2. Pour la création d'un nouveau canal
+    """
+    def __init__(self):
+        # Dictionnaire des informations utilisateurs
+        # Contrainte: Les utilisateurs peuvent être supprimés
+        self.lock_users = threading.Lock()
+        self.users = dict()
+
+        # Dictionnaire des canaux avec ensemble des utilisateurs connectés
+        # Simplification: Les canaux ne peuvent pas être supprimés
+        self.lock_channels = threading.Lock()
+        self.channels = dict()
+
+    def add_user(self, nick: str, channel: str) -> bool:
+        with self.lock_users:
+            if nick in self.users: return False
+            self.users[nick] = {"channel": channel, "away_msg": ""}
+        return True
+
+    def remove_user(self, nick: str):
+        self.users.pop(nick, None)
+
+    def has_user(self, nick: str) -> bool:
+        return nick in self.users
+
+    def list_users(self) -> List[str]:
+        return list(self.users.keys())
+
+    def get_channel(self, nick: str) -> str:
+        return self.users[nick]["channel"]
+
+    def set_channel(self, nick: str, channel: str):
+        self.users[nick]["channel"] = channel
+
+    def get_away(self, nick: str) -> Optional[str]:
+        user = self.users.get(nick)
+        return None if user is None else user["away_msg"]
+
+    def set_away(self, nick: str, away_msg: str):
+        self.users[nick]["away_msg"] = away_msg
+
+    def add_channel(self, channel: str, key: Optional[str]):
+        with self.lock_channels:
+            if channel not in self.channels:
+                self.channels[channel] = {"key": key, "users": set()}
+
+    def has_channel(self, channel: str) -> bool:
+        return channel in self.channels
+
+    def list_channels(self) -> List[str]:
+        return list(self.channels.keys())
+
+    def get_key(self, channel: str) -> Optional[str]:
+        return self.channels[channel]["key"]
+
+    def channel_users(self, channel: str) -> List[str]:
+        # Copie pour pouvoir itérer pendant que le canal est modifié
+        return list(self.channels[channel]["users"])
+
+    def join_channel(self, channel: str, nick: str):
+        self.channels[channel]["users"].add(nick)
+
+    def leave_channel(self, channel: str, nick: str):
+        self.channels[channel]["users"].discard(nick)
+
+
+class SQLiteStorageIRC(StorageIRC):
+    """
+    Stockage dans une base SQLite locale en mode WAL.
+
+    La base peut être lue par d'autres processus (outil d'administration,
+    serveur de secours) pendant que le serveur écrit.
+
+    Les écritures fréquentes (absence, changement de canal) sont mises en file
+    et écrites par lots dans une seule transaction :
+        1. Lorsque la file atteint batch_size écritures
+        2. Périodiquement toutes les flush_interval secondes
+        3. Avant toute lecture qui n'est pas servie par le cache
+
+    Les écritures structurelles (ajout/suppression d'utilisateur, création de canal)
+    sont immédiates pour garantir l'unicité des clés entre processus.
+
+    Les erreurs de la base (verrouillée par un autre processus) ne sont pas remontées :
+        1. Un lot qui n'a pas pu être écrit est remis en tête de file et réessayé
+        2. Une lecture est faite même si la file n'a pas pu être écrite
+        3. Une suppression d'utilisateur ou une création de canal est mise en file
+        4. Un ajout d'utilisateur est refusé
+
+    Les recherches par pseudo (has_user, get_away, get_channel) passent par
+    un cache en lecture valable cache_ttl secondes.
+    Seuls les utilisateurs existants sont mis en cache.
+    Les clés des canaux sont mises en cache sans expiration
+    puisque les canaux ne peuvent pas être supprimés.
+
+    Plusieurs serveurs peuvent partager la même base (serveur de secours).
+    Chaque utilisateur appartient au serveur auquel il est connecté (server_id)
+    et chaque serveur signale qu'il est en vie toutes les heartbeat_interval secondes.
+    Les utilisateurs d'un serveur silencieux depuis owner_timeout secondes
+    sont supprimés, ce qui libère leurs pseudos pour le serveur de secours.
+    Au démarrage les utilisateurs d'une exécution précédente du même serveur
+    sont supprimés puisque leurs connexions n'existent plus.
+    """
+    def __init__(self, path: str, server_id="default", batch_size=64,
+                 flush_interval=0.05, cache_ttl=1.0, busy_timeout=5.0,
+                 heartbeat_interval=1.0, owner_timeout=10.0):
+        """
+        :param path: Chemin du fichier de la base SQLite
+        :param server_id: Identifiant unique du serveur parmi ceux partageant la base
+        :param batch_size: Nombre d'écritures en file déclenchant une écriture
+        :param flush_interval: Délai maximal en secondes avant l'écriture de la file
+        :param cache_ttl: Durée de validité en secondes d'une entrée du cache
+        :param busy_timeout: Attente maximale en secondes d'une base verrouillée
+        :param heartbeat_interval: Délai en secondes entre deux signaux de vie
+        :param owner_timeout: Délai en secondes sans signal de vie
+        après lequel un serveur est considéré comme arrêté
+        """
+        self.server_id = server_id
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.cache_ttl = cache_ttl
+        self.heartbeat_interval = heartbeat_interval
+        self.owner_timeout = owner_timeout
+
+        # Une seule connexion partagée entre les threads et protégée par un verrou
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute(f"PRAGMA busy_timeout={int(busy_timeout * 1000)}")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS users (
+                nick TEXT PRIMARY KEY,
+                channel TEXT NOT NULL,
+                away_msg TEXT NOT NULL DEFAULT '',
+                owner TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS channels (
+                name TEXT PRIMARY KEY,
+                key TEXT);
+            CREATE TABLE IF NOT EXISTS members (
+                channel TEXT NOT NULL,
+                nick TEXT NOT NULL,
+                owner TEXT NOT NULL,
+                PRIMARY KEY (channel, nick));
+            CREATE TABLE IF NOT EXISTS servers (
+                id TEXT PRIMARY KEY,
+                last_seen REAL NOT NULL);
+        """)
+
+        # Suppression des utilisateurs d'une exécution précédente de ce serveur
+        # et de ceux des serveurs arrêtés puis premier signal de vie
+        self.__transaction(self.__purge("?", (server_id,)) + self.__heartbeat())
+        self.next_heartbeat = time.monotonic() + heartbeat_interval
+
+        # File des écritures en attente : liste de (requête, paramètres)
+        self.pending = []
+
+        # Cache des utilisateurs : pseudo -> (date d'expiration, {"channel", "away_msg"})
+        self.cache = dict()
+
+        # Cache des canaux : nom -> clé
+        # Les canaux créés alors que la base était verrouillée sont à relire
+        # une fois écrits car un autre processus a pu les créer avec une autre clé
+        self.keys = dict()
+        self.unconfirmed = set()
+
+        # Écriture périodique de la file
+        self.closed = threading.Event()
+        self.flusher = threading.Thread(target=self.__flush_loop, daemon=True)
+        self.flusher.start()
+
+
+    def __flush_loop(self):
+        while not self.closed.wait(self.flush_interval):
+            if time.monotonic() >= self.next_heartbeat:
+                self.next_heartbeat = time.monotonic() + self.heartbeat_interval
+                with self.lock: self.pending.extend(self.__heartbeat())
+            self.__try_flush()
+
+
+    def __purge(self, owners: str, params: tuple) -> list:
+        """
+        Écritures supprimant les utilisateurs de serveurs et ces serveurs.
+
+        :param owners: Sous-requête SQL sélectionnant les identifiants des serveurs
+        :param params: Paramètres de la sous-requête
+        :return: Liste de (requête, paramètres)
+        """
+        return [
+            (f"DELETE FROM members WHERE owner IN ({owners})", params),
+            (f"DELETE FROM users WHERE owner IN ({owners})", params),
+            (f"DELETE FROM servers WHERE id IN ({owners})", params)]
+
+
+    def __purge_dead(self) -> list:
+        """
+        :return: Écritures supprimant les utilisateurs des serveurs arrêtés
+        """
+        return self.__purge("SELECT id FROM servers WHERE last_seen < ? AND id != ?",
+                            (time.time() - self.owner_timeout, self.server_id))
+
+
+    def __heartbeat(self) -> list:
+        """
+        :return: Écritures du signal de vie de ce serveur et de la purge des serveurs arrêtés
+        """
+        return self.__purge_dead() + [(
+            "INSERT OR REPLACE INTO servers (id, last_seen) VALUES (?, ?)",
+            (self.server_id, time.time()))]
+
+
+    def __transaction(self, queries: list):
+        """
+        Exécute des écritures dans une seule transaction annulée en cas d'échec.
+
+        :param queries: Liste de (requête, paramètres)
+        """
+        try:
+            self.db.execute("BEGIN IMMEDIATE")
+            for query, params in queries: self.db.execute(query, params)
+            self.db.execute("COMMIT")
+        except sqlite3.Error:
+            # La connexion partagée ne doit pas rester dans une transaction ouverte
+            if self.db.in_transaction: self.db.execute("ROLLBACK")
+            raise
+
+
+    def flush(self):
+        """
+        Écrit toutes les écritures en attente dans une seule transaction.
+        En cas d'échec le lot est remis en tête de file et l'erreur est remontée.
+        """
+        with self.lock:
+            if not self.pending: return
+            pending, self.pending = self.pending, []
+            try: self.__transaction(pending)
+            except sqlite3.Error:
+                self.pending = pending + self.pending
+                raise
+            for channel in self.unconfirmed: self.keys.pop(channel, None)
+            self.unconfirmed.clear()
+
+
+    def __log(self, msg: str, error: sqlite3.Error):
+        print(f"{msg} : {error}", file=sys.stderr)
+
+
+    def __try_flush(self):
+        """
+        Écrit la file sans remonter l'erreur.
+        Le lot est conservé et sera réessayé à l'écriture suivante.
+        """
+        try: self.flush()
+        except sqlite3.Error as e: self.__log("Échec de l'écriture de la file", e)
+
+
+    def __write(self, query: str, params: tuple):
+        """
+        Met une écriture en file et écrit la file si elle est pleine.
+        Si l'écriture du lot échoue, il reste en file pour l'écriture périodique.
+        """
+        with self.lock:
+            self.pending.append((query, params))
+            if len(self.pending) >= self.batch_size: self.__try_flush()
+
+
+    def __query(self, query: str, params: tuple) -> list:
+        """
+        Lit la base après avoir écrit la file pour lire ses propres écritures.
+        Si la file n'a pas pu être écrite, la lecture est faite quand même.
+        """
+        with self.lock:
+            self.__try_flush()
+            return self.db.execute(query, params).fetchall()
+
+
+    def __user(self, nick: str) -> Optional[dict]:
+        """
+        Lecture d'un utilisateur à travers le cache.
+
+        :param nick: Pseudo de l'utilisateur
+        :return: {"channel", "away_msg"} ou None si l'utilisateur n'existe pas
+        """
+        entry = self.cache.get(nick)
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+
+        # La lecture et le remplissage du cache doivent être atomiques
+        # pour ne pas écraser une modification concurrente (suppression, absence...)
+        with self.lock:
+            entry = self.cache.get(nick)
+            if entry is not None and entry[0] > time.monotonic():
+                return entry[1]
+
+            rows = self.__query("SELECT channel, away_msg FROM users WHERE nick = ?", (nick,))
+            if not rows:
+                self.cache.pop(nick, None)
+                return None
+            user = {"channel": rows[0][0], "away_msg": rows[0][1]}
+            self.cache[nick] = (time.monotonic() + self.cache_ttl, user)
+            return user
+
+
+    def __channel(self, channel: str) -> Tuple[bool, Optional[str]]:
+        """
+        Lecture d'un canal à travers le cache.
+
+        :param channel: Nom du canal
+        :return: (existence du canal, clé du canal)
+        """
+        if channel in self.keys: return True, self.keys[channel]
+
+        with self.lock:
+            if channel in self.keys: return True, self.keys[channel]
+            rows = self.__query("SELECT key FROM channels WHERE name = ?", (channel,))
+            if not rows: return False, None
+            self.keys[channel] = rows[0][0]
+            return True, rows[0][0]
+
+
+    def add_user(self, nick: str, channel: str) -> bool:
+        with self.lock:
+            self.__try_flush()
+            # Si la base est verrouillée l'enregistrement est refusé
+            # sans attendre une seconde fois qu'elle soit déverrouillée
+            if self.pending: return False
+            query = ("INSERT OR IGNORE INTO users (nick, channel, owner) VALUES (?, ?, ?)",
+                     (nick, channel, self.server_id))
+            try:
+                added = self.db.execute(*query).rowcount == 1
+                # Le pseudo est peut-être détenu par un serveur arrêté
+                if not added:
+                    self.__transaction(self.__purge_dead())
+                    added = self.db.execute(*query).rowcount == 1
+            except sqlite3.Error as e:
+                self.__log(f"Échec de l'enregistrement de <{nick}>", e)
+                return False
+            if not added: return False
+            self.cache[nick] = (time.monotonic() + self.cache_ttl,
+                                {"channel": channel, "away_msg": ""})
+        return True
+
+    def remove_user(self, nick: str):
+        queries = [
+            ("DELETE FROM members WHERE nick = ?", (nick,)),
+            ("DELETE FROM users WHERE nick = ?", (nick,))]
+        with self.lock:
+            self.cache.pop(nick, None)
+            self.__try_flush()
+            if not self.pending:
+                try:
+                    self.__transaction(queries)
+                    return
+                except sqlite3.Error as e:
+                    self.__log(f"Échec de la suppression de <{nick}>", e)
+            # Si la base est verrouillée la suppression est mise en file
+            # après les écritures en attente pour ne pas laisser un utilisateur fantôme
+            self.pending.extend(queries)
+
+    def has_user(self, nick: str) -> bool:
+        return self.__user(nick) is not None
+
+    def list_users(self) -> List[str]:
+        return [row[0] for row in self.__query("SELECT nick FROM users", ())]
+
+    def get_channel(self, nick: str) -> str:
+        return self.__user(nick)["channel"]
+
+    def set_channel(self, nick: str, channel: str):
+        with self.lock:
+            user = self.__user(nick)
+            if user is not None: user["channel"] = channel
+            self.__write("UPDATE users SET channel = ? WHERE nick = ?", (channel, nick))
+
+    def get_away(self, nick: str) -> Optional[str]:
+        user = self.__user(nick)
+        return None if user is None else user["away_msg"]
+
+    def set_away(self, nick: str, away_msg: str):
+        with self.lock:
+            user = self.__user(nick)
+            if user is not None: user["away_msg"] = away_msg
+            self.__write("UPDATE users SET away_msg = ? WHERE nick = ?", (away_msg, nick))
+
+    def add_channel(self, channel: str, key: Optional[str]):
+        query = ("INSERT OR IGNORE INTO channels (name, key) VALUES (?, ?)", (channel, key))
+        with self.lock:
+            if channel in self.keys: return
+            self.__try_flush()
+            if not self.pending:
+                try:
+                    self.db.execute(*query)
+                    return
+                except sqlite3.Error as e:
+                    self.__log(f"Échec de la création de {channel}", e)
+            # Si la base est verrouillée la création est mise en file
+            # et le canal est utilisable localement en attendant
+            self.pending.append(query)
+            self.keys[channel] = key
+            self.unconfirmed.add(channel)
+
+    def has_channel(self, channel: str) -> bool:
+        return self.__channel(channel)[0]
+
+    def list_channels(self) -> List[str]:
+        channels = [row[0] for row in self.__query("SELECT name FROM channels", ())]
+        return channels + [c for c in self.unconfirmed if c not in channels]
+
+    def get_key(self, channel: str) -> Optional[str]:
+        return self.__channel(channel)[1]
+
+    def channel_users(self, channel: str) -> List[str]:
+        return [row[0] for row in
+                self.__query("SELECT nick FROM members WHERE channel = ?", (channel,))]
+
+    def join_channel(self, channel: str, nick: str):
+        self.__write("INSERT OR IGNORE INTO members (channel, nick, owner) VALUES (?, ?, ?)",
+                     (channel, nick, self.server_id))
+
+    def leave_channel(self, channel: str, nick: str):
+        self.__write("DELETE FROM members WHERE channel = ? AND nick = ?", (channel, nick))
+
+    def close(self):
+        self.closed.set()
+        self.flusher.join()
+        with self.lock:
+            # Les connexions de ce serveur sont fermées donc ses utilisateurs sont supprimés
+            self.pending.extend(self.__purge("?", (self.server_id,)))
+            self.__try_flush()
+            self.db.close()
@@ -0,0 +1,97 @@
+# Mesure du surcoût des stockages de l'état du serveur IRC
+# par rapport à de simples dictionnaires sur les opérations fréquentes
+
+import os
+import tempfile
+import timeit
+from StorageIRC import MemoryStorageIRC, SQLiteStorageIRC
+
+
+N_USERS = 1000
+N_CHANNELS = 10
+NUMBER = 20000
+
+
+class DictStorage:
+    """
+    Référence : accès direct aux dictionnaires sans passer par l'interface StorageIRC.
+    """
+    def __init__(self):
+        self.users = dict()
+        self.channels = dict()
+
+    def add_user(self, nick, channel):
+        self.users[nick] = {"channel": channel, "away_msg": ""}
+
+    def has_user(self, nick):
+        return nick in self.users
+
+    def get_away(self, nick):
+        return self.users[nick]["away_msg"]
+
+    def set_away(self, nick, away_msg):
+        self.users[nick]["away_msg"] = away_msg
+
+    def get_channel(self, nick):
+        return self.users[nick]["channel"]
+
+    def add_channel(self, channel, key):
+        self.channels[channel] = {"key": key, "users": set()}
+
+    def get_key(self, channel):
+        return self.channels[channel]["key"]
+
+    def channel_users(self, channel):
+        # Même copie que le serveur pour ne mesurer que le coût de l'interface
+        return list(self.channels[channel]["users"])
+
+    def join_channel(self, channel, nick):
+        self.channels[channel]["users"].add(nick)
+
+    def close(self):
+        pass
+
+
+def fill(storage):
+    for c in range(N_CHANNELS):
+        storage.add_channel(f"#chan{c}", None)
+    for u in range(N_USERS):
+        chan = f"#chan{u % N_CHANNELS}"
+        storage.add_user(f"user{u}", chan)
+        storage.join_channel(chan, f"user{u}")
+
+
+def bench(name, storage):
+    fill(storage)
+    ops = {
+        # /msg nick : test d'existence et message d'absence du destinataire
+        "get_away": lambda: storage.get_away("user42"),
+        # /invite nick
+        "has_user": lambda: storage.has_user("user42"),
+        "get_channel": lambda: storage.get_channel("user42"),
+        "get_key": lambda: storage.get_key("#chan2"),
+        # /msg sur un canal : destinataires de la diffusion
+        "channel_users": lambda: storage.channel_users("#chan2"),
+        # /away
+        "set_away": lambda: storage.set_away("user42", "absent"),
+    }
+    results = dict()
+    for op, f in ops.items():
+        t = timeit.timeit(f, number=NUMBER)
+        results[op] = t / NUMBER * 1e6
+    storage.close()
+    return results
+
+
+if __name__ == "__main__":
+    tmp = tempfile.mkdtemp()
+    backends = [
+        ("dict", DictStorage()),
+        ("memory", MemoryStorageIRC()),
+        ("sqlite", SQLiteStorageIRC(os.path.join(tmp, "bench.db"))),
+    ]
+    results = {name: bench(name, storage) for name, storage in backends}
+
+    print(f"{'opération':<15}" + "".join(f"{name + ' (µs)':>15}" for name, _ in backends))
+    for op in results["dict"]:
+        print(f"{op:<15}" + "".join(f"{results[name][op]:>15.3f}" for name, _ in backends))
@@ -15,3 +15,7 @@ CHANNEL_KEY_ERROR = "CHANNEL_KEY_ERROR".encode('utf-8')
 
 # La commande est inconnue
 UNKNOWN_CMD_ERROR = "UNKNOWN_CMD_ERROR".encode('utf-8')
+
+# L'utilisateur est connecté à un autre serveur partageant le même stockage
+# donc on ne peut pas lui envoyer de message ni l'inviter
+REMOTE_USER_ERROR = "REMOTE_USER_ERROR".encode('utf-8')
@@ -1,13 +1,24 @@
-import sys
 import socket
 import threading
+import argparse
 import datetime as dt
 import shlex
 from ServerIRC import ServerIRC
-
-
-host = sys.argv[1]
-port = int(sys.argv[2])
+from StorageIRC import MemoryStorageIRC, SQLiteStorageIRC
+
+
+# Parsing des arguments de la ligne de commande
+parser = argparse.ArgumentParser(description='Serveur de Mini IRC.')
+parser.add_argument("host", type=str, help="Adresse du serveur IRC")
+parser.add_argument("port", type=int, help="Port du serveur IRC")
+parser.add_argument("db", type=str, nargs="?", default=None,
+    help="Fichier SQLite pour partager l'état du serveur avec d'autres processus")
+parser.add_argument("--id", type=str, default=None,
+    help="Identifiant unique du serveur parmi ceux partageant le fichier SQLite "
+         "(par défaut hôte:port)")
+args = parser.parse_args()
+if args.id is not None and args.db is None:
+    parser.error("l'option --id nécessite un fichier SQLite")
 
 def logging(msg):
     print(f"[{dt.datetime.now().strftime('%Y-%d-%m %H:%M:%S')}] {msg}")
@@ -38,7 +49,10 @@ DEFAULT_CHANNEL = "#default"
 
 
 # Initialisation du seveur IRC
-server = ServerIRC(help_msg=HELP, default_channel=DEFAULT_CHANNEL)
+storage = (
+    SQLiteStorageIRC(args.db, server_id=args.id or f"{args.host}:{args.port}") if args.db
+    else MemoryStorageIRC())
+server = ServerIRC(help_msg=HELP, default_channel=DEFAULT_CHANNEL, storage=storage)
 
 def exec_cmd(sc):
     global server
@@ -109,7 +123,7 @@ def exec_cmd(sc):
 
 s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-s.bind((host, port))
+s.bind((args.host, args.port))
 # Le serveur peut traiter jusqu'à 100 connexions
 s.listen(100)
 
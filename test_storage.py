@@ -0,0 +1,235 @@
+# Vérification des stockages de l'état du serveur IRC
+# Exécution : python3 -m pytest test_storage.py
+
+import socket
+import sqlite3
+import threading
+import time
+import pytest
+from protocol import *
+from ServerIRC import ServerIRC
+from StorageIRC import MemoryStorageIRC, SQLiteStorageIRC
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "test.db")
+
+
+def sqlite_storage(path, server_id="test", **kwargs):
+    """
+    Stockage SQLite sans écriture périodique pour que les tests
+    décident eux-mêmes quand la file est écrite.
+    """
+    kwargs.setdefault("flush_interval", 60)
+    return SQLiteStorageIRC(path, server_id=server_id, **kwargs)
+
+
+def lock_database(path):
+    """
+    Simule un autre processus qui verrouille la base en écriture.
+
+    :return: Connexion détenant le verrou, à libérer par COMMIT
+    """
+    other = sqlite3.connect(path, isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+    return other
+
+
+def connect(server, nick):
+    """
+    Connecte un faux client au serveur par une paire de sockets.
+
+    :return: Socket côté client ou None si le pseudo est refusé
+    """
+    sc, client = socket.socketpair()
+    client.settimeout(1)
+    if not server.add_user(sc, nick): return None
+    client.recv(1024) # Canal par défaut
+    return client
+
+
+def scenario(storage):
+    """
+    Même scénario de commandes exécuté sur chaque stockage.
+    """
+    server = ServerIRC(b"help", "#default", storage=storage)
+    alice = connect(server, "alice")
+    bob = connect(server, "bob")
+    assert connect(server, "bob") is None
+
+    server.msg(["/msg", "bob", "hi"], "alice")
+    assert bob.recv(1024) == b"<alice> hi"
+
+    server.away(["/away", "brb"], "bob")
+    server.msg(["/msg", "bob", "hi"], "alice")
+    assert alice.recv(1024) == b"<bob> brb"
+    server.away(["/away"], "bob")
+
+    server.join(["/join", "x", "k"], "alice")
+    assert alice.recv(1024) == b"/join #x"
+    server.invite(["/invite", "bob"], "alice")
+    assert bob.recv(1024).endswith(b"Mot de passe : [k].")
+    server.join(["/join", "x"], "bob")
+    assert bob.recv(1024) == CHANNEL_KEY_ERROR
+    server.msg(["/msg", "#x", "yo"], "bob")
+    assert bob.recv(1024) == CHANNEL_KEY_ERROR
+
+    server.msg(["/msg", "#default", "all"], "alice")
+    assert bob.recv(1024) == b"#default <alice> all"
+
+    server.names(["/names"], "bob")
+    assert sorted(bob.recv(1024).split(b"\n")) == [b"alice", b"bob"]
+    server.names(["/names", "default"], "bob")
+    assert bob.recv(1024) == b"bob"
+    server.list("bob")
+    assert sorted(bob.recv(1024).split(b"\n")) == [b"#default", b"#x"]
+
+    server.exit("bob")
+    server.msg(["/msg", "bob", "x"], "alice")
+    assert alice.recv(1024) == NICKNAME_ERROR
+    server.invite(["/invite", "bob"], "alice")
+    assert alice.recv(1024) == NICKNAME_ERROR
+    storage.close()
+
+
+def test_memory_scenario():
+    scenario(MemoryStorageIRC())
+
+
+def test_sqlite_scenario(path):
+    scenario(sqlite_storage(path))
+
+
+def test_sqlite_unique_nick_between_servers(path):
+    s1, s2 = sqlite_storage(path, "s1"), sqlite_storage(path, "s2")
+    assert s1.add_user("alice", "#default")
+    assert not s2.add_user("alice", "#default")
+    assert s2.has_user("alice")
+    s1.close(); s2.close()
+
+
+def test_sqlite_batched_writes(path):
+    storage = sqlite_storage(path, batch_size=3)
+    reader = sqlite3.connect(path)
+    storage.add_user("alice", "#default")
+
+    # Écritures en file : visibles par le cache mais pas encore dans la base
+    storage.set_away("alice", "a")
+    storage.set_away("alice", "b")
+    assert storage.get_away("alice") == "b"
+    assert reader.execute("SELECT away_msg FROM users").fetchall() == [("",)]
+
+    # La file pleine est écrite
+    storage.set_away("alice", "c")
+    assert storage.pending == []
+    assert reader.execute("SELECT away_msg FROM users").fetchall() == [("c",)]
+    storage.close()
+
+
+def test_sqlite_failed_flush_is_retried(path):
+    storage = sqlite_storage(path, busy_timeout=0.01)
+    storage.add_user("u", "#default")
+
+    other = lock_database(path)
+    storage.set_away("u", "away")
+    with pytest.raises(sqlite3.OperationalError): storage.flush()
+    assert len(storage.pending) == 1
+    assert not storage.db.in_transaction
+    assert storage.get_away("u") == "away"
+
+    # Le lot est écrit une fois la base déverrouillée
+    other.execute("COMMIT")
+    storage.flush()
+    assert storage.pending == []
+    assert other.execute("SELECT away_msg FROM users").fetchall() == [("away",)]
+    storage.close()
+
+
+def test_sqlite_cache_expires(path):
+    storage = sqlite_storage(path, cache_ttl=0.05)
+    storage.add_user("alice", "#default")
+    assert storage.get_away("alice") == ""
+
+    # Modification par un autre processus : invisible tant que le cache est valide
+    other = sqlite3.connect(path, isolation_level=None)
+    other.execute("UPDATE users SET away_msg = 'absent' WHERE nick = 'alice'")
+    assert storage.get_away("alice") == ""
+    time.sleep(0.1)
+    assert storage.get_away("alice") == "absent"
+    storage.close()
+
+
+def test_sqlite_cache_not_filled_after_remove(path):
+    storage = sqlite_storage(path)
+
+    # Lectures concurrentes d'un utilisateur supprimé juste après
+    # Aucune lecture ne doit remettre l'utilisateur dans le cache
+    for _ in range(100):
+        storage.add_user("x", "#default")
+        storage.cache.clear()
+        readers = [threading.Thread(target=storage.has_user, args=("x",)) for _ in range(4)]
+        for reader in readers: reader.start()
+        storage.remove_user("x")
+        for reader in readers: reader.join()
+        assert not storage.has_user("x")
+    storage.close()
+
+
+def test_sqlite_locked_msg_and_exit(path):
+    storage = sqlite_storage(path, busy_timeout=0.01)
+    server = ServerIRC(b"help", "#default", storage=storage)
+    alice = connect(server, "alice")
+    bob = connect(server, "bob")
+    storage.flush()
+
+    other = lock_database(path)
+
+    # Les lectures se font même si la file ne peut pas être écrite
+    server.away(["/away"], "bob")
+    server.msg(["/msg", "hello"], "alice")
+    assert bob.recv(1024) == b"#default <alice> hello"
+
+    # Le socket est fermé et la suppression est mise en file
+    server.exit("bob")
+    assert bob.recv(1024) == b""
+    other.execute("COMMIT")
+    storage.flush()
+    assert other.execute("SELECT nick FROM users").fetchall() == [("alice",)]
+    assert other.execute("SELECT nick FROM members").fetchall() == [("alice",)]
+
+    # Le pseudo est à nouveau disponible
+    assert connect(server, "bob") is not None
+    storage.close()
+
+
+def test_sqlite_failover(path):
+    primary = sqlite_storage(path, "primary")
+    standby = sqlite_storage(path, "standby")
+    assert primary.add_user("alice", "#default")
+    assert not standby.add_user("alice", "#default")
+
+    # Le serveur principal ne donne plus signe de vie
+    other = sqlite3.connect(path, isolation_level=None)
+    other.execute("UPDATE servers SET last_seen = 0 WHERE id = 'primary'")
+    assert standby.add_user("alice", "#default")
+    assert other.execute("SELECT owner FROM users").fetchall() == [("standby",)]
+
+    # Au redémarrage un serveur supprime les utilisateurs de son exécution précédente
+    restarted = sqlite_storage(path, "standby")
+    assert other.execute("SELECT nick FROM users").fetchall() == []
+    primary.close(); standby.close(); restarted.close()
+
+
+def test_sqlite_remote_user(path):
+    server1 = ServerIRC(b"help", "#default", storage=sqlite_storage(path, "s1"))
+    server2 = ServerIRC(b"help", "#default", storage=sqlite_storage(path, "s2"))
+    alice = connect(server1, "alice")
+    bob = connect(server2, "bob")
+    assert connect(server1, "bob") is None
+
+    server1.msg(["/msg", "bob", "hi"], "alice")
+    assert alice.recv(1024) == REMOTE_USER_ERROR
+    server1.invite(["/invite", "bob"], "alice")
+    assert alice.recv(1024) == REMOTE_USER_ERROR
+    server1.storage.close(); server2.storage.close()